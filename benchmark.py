@@ -0,0 +1,115 @@
+# Fujitsu AC Plugin - micro-benchmark of the device update loop
+#
+# Author: 593304
+#
+# Measures Helper.updateDomoticzDevices() with stubbed Domoticz and pyfujitseu
+# modules, no FGLair account is needed. The device values do not change
+# between the cycles, so the results show the steady state. Older revisions
+# of the plugin can be compared by exporting them first, for example:
+#   git show <revision>:plugin.py > /tmp/plugin_old.py
+#   python3 benchmark.py plugin.py /tmp/plugin_old.py
+import builtins
+import importlib.util
+import os
+import sys
+import timeit
+import types
+
+AC_COUNTS = [1, 10, 23]
+CYCLES = 200
+REPEAT = 20
+
+
+class Device():
+    def __init__(self, Name, Unit, **kwargs):
+        self.Name = Name
+        self.Unit = Unit
+        self.nValue = 0
+        self.sValue = ""
+
+    def Create(self):
+        Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+
+
+class SplitAC():
+    def __init__(self, dsn, api):
+        self.device_name = {"value": "AC %s" % (dsn)}
+        self.operation_mode_desc = "cool"
+        self.adjust_temperature_degree = 22.5
+        self.economy_mode = {"value": 0}
+        self.powerful_mode = {"value": 1}
+        self.af_vertical_swing = {"value": 0}
+        self.af_horizontal_swing = {"value": 1}
+        self.af_vertical_direction = {"value": 3}
+        self.af_horizontal_direction = {"value": 2}
+
+    def get_fan_speed_desc(self):
+        return "Auto"
+
+    def get_swing_mode_desc(self):
+        return "Swing"
+
+
+def installStubs():
+    domoticz = types.ModuleType("Domoticz")
+    for name in ["Log", "Debug", "Error", "Debugging", "Heartbeat"]:
+        setattr(domoticz, name, lambda *args: None)
+    domoticz.Device = Device
+    domoticz.Configuration = lambda *args: {}
+    splitAC = types.ModuleType("pyfujitseu.splitAC")
+    splitAC.splitAC = SplitAC
+    splitAC.api = object
+    pyfujitseu = types.ModuleType("pyfujitseu")
+    pyfujitseu.splitAC = splitAC
+    sys.modules.update({"Domoticz": domoticz, "pyfujitseu": pyfujitseu, "pyfujitseu.splitAC": splitAC})
+    builtins.Devices = {}
+    builtins.Parameters = {}
+
+
+def loadPlugin(path):
+    spec = importlib.util.spec_from_file_location("plugin_%d" % (abs(hash(path))), path)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+# Supports the dict based state of the earlier revisions too
+def createHelper(plugin, acCount):
+    Devices.clear()
+    if hasattr(plugin, "AcState"):
+        helper = plugin.Helper([], 10, plugin.ConfigStore(60), False)
+    else:
+        helper = plugin.Helper("user", "password", "eu")
+    for index in range(acCount):
+        dsn = "DSN%d" % (index)
+        ac = SplitAC(dsn, None)
+        if hasattr(plugin, "AcState"):
+            helper.acs[dsn] = plugin.AcState(ac, None, index * 11)
+            helper.databaseStore[dsn] = {"account": None, "unitClass": index * 11}
+        else:
+            helper.acs[dsn] = {"ac": ac, "unitClass": index * 11}
+        helper.createDomoticzDevices(dsn)
+    return helper
+
+
+def main():
+    installStubs()
+    paths = sys.argv[1:] or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.py")]
+    for path in paths:
+        plugin = loadPlugin(path)
+        for acCount in AC_COUNTS:
+            helper = createHelper(plugin, acCount)
+            helper.updateDomoticzDevices()
+            best = min(timeit.repeat(helper.updateDomoticzDevices, number=CYCLES, repeat=REPEAT)) / CYCLES
+            print("%s: %3d units: %.1f us/cycle" % (path, len(helper.units), best * 1000000))
+            if hasattr(helper, "shutdown"):
+                helper.shutdown()
+    return
+
+
+if __name__ == "__main__":
+    main()
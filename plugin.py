@@ -21,6 +21,7 @@
                 <option label="Other" value="other"/>
             </options>
         </param>
+        <param field="Mode5" label="Additional accounts" width="400px" password="true"/>
         <param field="Mode3" label="Refresh interval" width="100px">
             <options>
                 <option label="5" value="5"/>
@@ -35,6 +36,17 @@
                 <option label="180" value="180"/>
             </options>
         </param>
+        <param field="Mode6" label="API traffic" width="200px">
+            <options>
+                <option label="Off" value="off" default="off"/>
+                <option label="Record" value="record"/>
+                <option label="Replay" value="replay:1"/>
+                <option label="Replay, 2x slower" value="replay:2"/>
+                <option label="Replay, 2x faster" value="replay:0.5"/>
+                <option label="Replay, 10x faster" value="replay:0.1"/>
+                <option label="Replay without delays" value="replay:0"/>
+            </options>
+        </param>
         <param field="Mode4" label="Debug" width="50px">
             <options>
                 <option label="On" value="on"/>
@@ -46,31 +58,358 @@
 """
 import Domoticz
 from pyfujitseu import splitAC
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import copy
+import hashlib
+import hmac
 import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
 
 DATABASE_KEY = "FujitsuACPlugin"
+CONFIG_FLUSH_INTERVAL = 60
+WORKER_POOL_SIZE = 4
+UNIT_CLASS_SIZE = 11
+MAX_UNIT = 255
+TEMPERATURE_REPORT_INTERVAL = 300
+TEMPERATURE_DEVICE_TYPE = 80
+OUTDOOR_TEMPERATURE_TABLE_FILE = "outdoor_temperature_table.json"
+TRAFFIC_FILE = "fglair_traffic.jsonl"
+TRAFFIC_KEY_FILE = "fglair_traffic.key"
+REDACTED_KEYS = ["password", "app_secret"]
+PSEUDONYM_KEYS = ["email", "username", "access_token", "refresh_token"]
+
+# Configuration store
+#
+# Keeps the plugin configuration in memory and tracks the changed items,
+# Domoticz.Configuration() always replaces the whole configuration, so the
+# changes are merged into a fresh read and written in batches at most once
+# per flush interval
+class ConfigStore():
+    def __init__(self, flushInterval):
+        self.flushInterval = flushInterval
+        self.config = {}
+        self.loaded = False
+        self.dirtyKeys = set()
+        self.lastFlush = None
+        return
+
+    def load(self):
+        try:
+            self.config = dict(Domoticz.Configuration())
+            self.loaded = True
+        except Exception as inst:
+            Domoticz.Error("Domoticz.Configuration read failed, changes will not be saved: '%s'" % (str(inst)))
+        return
+
+    def getSection(self, section):
+        value = self.config.get(section)
+        return copy.deepcopy(value) if isinstance(value, dict) else {}
+
+    def setItem(self, section, key, value):
+        if not isinstance(self.config.get(section), dict):
+            self.config[section] = {}
+        items = self.config[section]
+        if key in items and items[key] == value:
+            return
+        items[key] = copy.deepcopy(value)
+        self.dirtyKeys.add((section, key))
+        return
+
+    def removeItem(self, section, key):
+        items = self.config.get(section)
+        if isinstance(items, dict) and key in items:
+            del items[key]
+            self.dirtyKeys.add((section, key))
+        return
+
+    # The changes are based on the loaded configuration, without a successful
+    # load they would overwrite the stored items, so nothing is written
+    def flush(self, force=False):
+        if len(self.dirtyKeys) == 0 or not self.loaded:
+            return
+        now = time.monotonic()
+        if not force and self.lastFlush is not None and now - self.lastFlush < self.flushInterval:
+            return
+        self.lastFlush = now
+        try:
+            config = dict(Domoticz.Configuration())
+            for section, key in self.dirtyKeys:
+                items = self.config.get(section, {})
+                if not isinstance(config.get(section), dict):
+                    config[section] = {}
+                if key in items:
+                    config[section][key] = copy.deepcopy(items[key])
+                elif key in config[section]:
+                    del config[section][key]
+            Domoticz.Configuration(config)
+        except Exception as inst:
+            Domoticz.Error("Domoticz.Configuration operation failed: '%s'" % (str(inst)))
+            return
+        Domoticz.Debug("Saved %d changed configuration item(s)" % (len(self.dirtyKeys)))
+        self.dirtyKeys = set()
+        return
+
+
+# API traffic capture and replay
+#
+# The pyfujitseu module calls the FGLair API through the requests module, the
+# transports below replace that reference to record or serve the exchanges.
+# Passwords are dropped, identities and tokens are replaced with stable
+# pseudonyms, so the exchanges of different accounts can be told apart. The
+# pseudonyms are keyed with a random key of the recording, which is saved into
+# a separate file, so the recording can be shared without it
+class Redactor():
+    def __init__(self, key):
+        self.key = key
+        return
+
+    def pseudonym(self, value):
+        value = str(value)
+        if value.startswith("REDACTED"):
+            return value
+        return "REDACTED-%s" % (hmac.new(self.key, value.encode("utf-8"), hashlib.sha256).hexdigest()[:16])
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            redacted = {}
+            for key in value:
+                if key.lower() in REDACTED_KEYS:
+                    redacted[key] = "REDACTED"
+                elif key.lower() in PSEUDONYM_KEYS:
+                    redacted[key] = self.pseudonym(value[key])
+                else:
+                    redacted[key] = self.redact(value[key])
+            return redacted
+        if isinstance(value, list):
+            return [self.redact(item) for item in value]
+        return value
 
-# Configuration Helpers
-def getConfigItem():
-    value = {}
+    # The header is "auth_token <token>", only the token is replaced, so it
+    # gets the same pseudonym as the access_token of the login response
+    def redactHeaders(self, headers):
+        redacted = dict(headers or {})
+        for key in redacted:
+            if key.lower() != "authorization":
+                continue
+            fields = str(redacted[key]).split(" ", 1)
+            if len(fields) == 2:
+                redacted[key] = "%s %s" % (fields[0], self.pseudonym(fields[1].strip()))
+            else:
+                redacted[key] = self.pseudonym(fields[0])
+        return redacted
+
+    # The account which sent the request, the auth header or the login body
+    def identity(self, headers, body):
+        for key, value in headers.items():
+            if key.lower() == "authorization":
+                return value
+        return json.dumps(body, sort_keys=True) if body is not None else ""
+
+
+def _getBody(kwargs):
+    body = kwargs.get("json")
+    if body is None:
+        body = _loadBody(kwargs.get("data"))[1]
+    return body
+
+def _loadBody(text):
     try:
-        config = Domoticz.Configuration()
-        value = config[DATABASE_KEY]
-    except KeyError:
-        value = {}
-    except Exception as inst:
-        Domoticz.Error("Domoticz.Configuration read failed: '%s'" % (str(inst)))
-    return value
-    
-def setConfigItem(value):
-    config = {}
+        return True, json.loads(text)
+    except (TypeError, ValueError):
+        return False, text
+
+
+class RecordingTransport():
+    def __init__(self, requests, path, key):
+        self.original = requests
+        self.path = path
+        self.redactor = Redactor(key)
+        self.lock = threading.Lock()
+        return
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+    def request(self, method, url, **kwargs):
+        start = time.monotonic()
+        response = self.original.request(method, url, **kwargs)
+        elapsed = time.monotonic() - start
+        isJson, responseBody = _loadBody(response.text)
+        with self.lock:
+            headers = self.redactor.redactHeaders(kwargs.get("headers"))
+            body = self.redactor.redact(_getBody(kwargs))
+            exchange = {
+                "method": method.upper(),
+                "url": url,
+                "identity": self.redactor.identity(headers, body),
+                "headers": headers,
+                "request": body,
+                "status": response.status_code,
+                "json": isJson,
+                "response": self.redactor.redact(responseBody) if isJson else responseBody,
+                "elapsed": elapsed
+            }
+            with open(self.path, "a") as trafficFile:
+                trafficFile.write(json.dumps(exchange) + "\n")
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+class ReplayResponse():
+    def __init__(self, exchange):
+        self.status_code = exchange["status"]
+        self.ok = self.status_code < 400
+        self.text = json.dumps(exchange["response"]) if exchange["json"] else (exchange["response"] or "")
+        self.content = self.text.encode("utf-8")
+        self.headers = {}
+        return
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise Exception("HTTP error %d (replayed)" % (self.status_code))
+        return
+
+
+# Serves the recorded exchanges in order per method, URL and account, the last one is
+# repeated when the session runs longer than the recording
+class ReplayTransport():
+    def __init__(self, requests, path, key, latencyScale):
+        self.original = requests
+        self.latencyScale = latencyScale
+        self.redactor = Redactor(key)
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        with open(path) as trafficFile:
+            for line in trafficFile:
+                if line.strip() == "":
+                    continue
+                exchange = json.loads(line)
+                self.exchanges.setdefault((exchange["method"], exchange["url"], exchange["identity"]), []).append(exchange)
+        return
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            headers = self.redactor.redactHeaders(kwargs.get("headers"))
+            identity = self.redactor.identity(headers, self.redactor.redact(_getBody(kwargs)))
+            queue = self.exchanges.get((method.upper(), url, identity))
+            if not queue:
+                raise Exception("No recorded response for %s %s" % (method.upper(), url))
+            exchange = queue.pop(0) if len(queue) > 1 else queue[0]
+        if self.latencyScale > 0:
+            time.sleep(exchange["elapsed"] * self.latencyScale)
+        return ReplayResponse(exchange)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+def setupTraffic(mode, homeFolder):
+    modules = [module for module in [sys.modules[splitAC.api.__module__], splitAC] if hasattr(module, "requests")]
+    requests = None
+    for module in modules:
+        # Restoring the original module after a plugin restart
+        module.requests = getattr(module.requests, "original", module.requests)
+        requests = module.requests
+    if mode != "record" and not mode.startswith("replay:"):
+        return False
+    if requests is None:
+        Domoticz.Error("The pyfujitseu module does not use requests, API traffic can not be captured")
+        return False
+
+    path = os.path.join(homeFolder, TRAFFIC_FILE)
+    keyPath = os.path.join(homeFolder, TRAFFIC_KEY_FILE)
     try:
-        config = Domoticz.Configuration()
-        config[DATABASE_KEY] = value
-        config = Domoticz.Configuration(config)
+        if mode == "record":
+            # Every recording starts with a new file and a new key
+            key = os.urandom(32)
+            with open(keyPath, "w") as keyFile:
+                keyFile.write(key.hex())
+            open(path, "w").close()
+            transport = RecordingTransport(requests, path, key)
+            Domoticz.Log("Recording API traffic to %s" % (path))
+        else:
+            latencyScale = float(mode.split(":", 1)[1])
+            with open(keyPath) as keyFile:
+                key = bytes.fromhex(keyFile.read().strip())
+            transport = ReplayTransport(requests, path, key, latencyScale)
+            Domoticz.Log("Replaying API traffic from %s with %s times the recorded latency" % (path, str(latencyScale)))
     except Exception as inst:
-        Domoticz.Error("Domoticz.Configuration operation failed: '%s'" % (str(inst)))
-    return config
+        Domoticz.Error("API traffic setup failed: '%s'" % (str(inst)))
+        return False
+
+    for module in modules:
+        module.requests = transport
+    return True
+
+
+# Splits the "username|password|region" entries separated by commas into
+# their fields, a backslash escapes the next character(e.g. "\|" or "\,")
+def parseAccountEntries(text):
+    entries = [[""]]
+    escaped = False
+    for character in text:
+        if escaped:
+            entries[-1][-1] += character
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == ",":
+            entries.append([""])
+        elif character == "|":
+            entries[-1].append("")
+        else:
+            entries[-1][-1] += character
+    return entries
+
+# Accounts are given as "username|password|region" entries separated by commas,
+# the region is optional and defaults to the region of the main account
+def getAccounts(username, password, region, additionalAccounts, tokenFolder):
+    accounts = [Account(username, password, region, tokenFolder)]
+    for fields in parseAccountEntries(additionalAccounts):
+        if len(fields) == 1 and fields[0].strip() == "":
+            continue
+        if len(fields) < 2 or len(fields) > 3:
+            Domoticz.Error("Invalid account entry for %s, expected username|password|region, escape | and , in the password with a backslash" % (fields[0].strip()))
+            continue
+        accountRegion = fields[2].strip() if len(fields) > 2 and fields[2].strip() != "" else region
+        if any(account.username == fields[0].strip() for account in accounts):
+            Domoticz.Error("Account %s is configured more than once, skipping" % (fields[0].strip()))
+            continue
+        accounts.append(Account(fields[0].strip(), fields[1], accountRegion, tokenFolder))
+    return accounts
 
 
 # Simple heartbeat with 5-180 secs interval
@@ -104,84 +443,480 @@ class Heartbeat():
             self.callback()
 
 
-class Helper():
-    def __init__(self, username, password, region):
+# Converts the value of an On/Off switch, the results are cached by value
+class Switch():
+    __slots__ = ("states",)
+
+    def __init__(self):
+        self.states = {}
+        return
+
+    def convert(self, value, isOn):
+        state = self.states.get(value)
+        if state is None:
+            state = (0, "Off") if str(value).lower() == "off" else (1, "On")
+            self.states[value] = state
+        return state
+
+
+# Maps selector levels(10, 20, ...) to air conditioner values and back,
+# the lookup table is prepared once and shared by the units of every device
+class Selector():
+    __slots__ = ("commandValues", "levels")
+
+    def __init__(self, values, aliases=None):
+        self.commandValues = {}
+        self.levels = {}
+        for index, value in enumerate(values):
+            level = str(10 * (index + 1))
+            self.commandValues[level] = value
+            self.levels[value] = level
+            self.levels[str(value).lower()] = level
+            if not isinstance(value, str):
+                self.levels[str(float(value))] = level
+        aliases = aliases or {}
+        for alias in aliases:
+            self.levels[alias] = self.levels[aliases[alias]]
+        return
+
+    # Unknown values are not added to the shared table
+    def convert(self, value, isOn):
+        level = self.levels.get(value)
+        if level is None:
+            level = self._getLevel(value)
+        return (1 if isOn else 0, level)
+
+    def _getLevel(self, value):
+        key = str(value).lower()
+        if "fan" in key:
+            key = "fan only"
+        return self.levels.get(key, str(value))
+
+
+SWITCH = Switch()
+TEMPERATURE_SELECTOR = Selector([18 + index * 0.5 for index in range(29)])
+OPERATION_SELECTOR = Selector(["Off", "Auto", "Cool", "Dry", "Fan only", "Heat"], {"fan_only": "Fan only"})
+FAN_SPEED_SELECTOR = Selector(["Quiet", "Low", "Medium", "High", "Auto"])
+SWING_MODE_SELECTOR = Selector(["Horizontal", "Down", "Unknown", "Swing"])
+DIRECTION_SELECTOR = Selector([1, 2, 3, 4, 5, 6, 7])
+
+
+# FGLair reports the room temperature(display_temperature) in hundredths of Fahrenheit degrees
+def getTemperature(temperature):
+    try:
+        return round((float(temperature["value"]) / 100 - 32) / 1.8, 1)
+    except (KeyError, TypeError, ValueError):
+        return float("nan")
+
+
+# Fixed-size batch of the room temperature samples of a device, the samples
+# are averaged when the batch is full to limit the number of rows written into
+# the Domoticz history, then the batch starts over
+class TemperatureBatch():
+    __slots__ = ("samples", "count")
+
+    def __init__(self, size):
+        self.samples = array("d", [0.0] * size)
+        self.count = 0
+        return
+
+    def add(self, temperature):
+        self.samples[self.count] = temperature
+        self.count += 1
+        return
+
+    def isFull(self):
+        return self.count == len(self.samples)
+
+    # Missing samples(NaN) are left out of the average
+    def average(self):
+        total = 0.0
+        count = 0
+        for index in range(self.count):
+            if self.samples[index] == self.samples[index]:
+                total += self.samples[index]
+                count += 1
+        self.count = 0
+        return round(total / count, 1) if count > 0 else None
+
+
+# FGLair reports the outdoor temperature(outdoor_temperature) as a raw sensor
+# value, it is converted with a table of [raw value, Celsius degree] points,
+# the values between two points are interpolated linearly
+class OutdoorTemperatureTable():
+    __slots__ = ("raws", "temperatures")
+
+    def __init__(self, points):
+        points = sorted([float(raw), float(temperature)] for raw, temperature in points)
+        if len(points) < 2:
+            raise ValueError("at least 2 points are needed")
+        self.raws = array("d", [point[0] for point in points])
+        self.temperatures = array("d", [point[1] for point in points])
+        return
+
+    # Values outside of the table are unknown(NaN)
+    def decode(self, temperature):
+        try:
+            raw = float(temperature["value"])
+        except (KeyError, TypeError, ValueError):
+            return float("nan")
+        index = bisect.bisect_left(self.raws, raw)
+        if index == len(self.raws):
+            return float("nan")
+        if self.raws[index] == raw:
+            return round(self.temperatures[index], 1)
+        if index == 0:
+            return float("nan")
+        ratio = (raw - self.raws[index - 1]) / (self.raws[index] - self.raws[index - 1])
+        return round(self.temperatures[index - 1] + ratio * (self.temperatures[index] - self.temperatures[index - 1]), 1)
+
+
+# The table is not shipped with the plugin, the outdoor sensors are only
+# created if it is placed into the plugin folder
+def loadOutdoorTemperatureTable(homeFolder):
+    path = os.path.join(homeFolder, OUTDOOR_TEMPERATURE_TABLE_FILE)
+    if not os.path.exists(path):
+        Domoticz.Log("Outdoor temperature table(%s) not found, the outdoor temperature sensors are disabled" % (path))
+        return None
+    try:
+        with open(path) as tableFile:
+            return OutdoorTemperatureTable(json.load(tableFile))
+    except Exception as inst:
+        Domoticz.Error("Failed to load the outdoor temperature table: '%s'" % (str(inst)))
+        return None
+
+
+class TemperatureSensor():
+    __slots__ = ("dsn", "ac", "property", "decode", "unit", "batch", "reported")
+
+    def __init__(self, dsn, ac, property, decode, unit, size):
+        self.dsn = dsn
+        self.ac = ac
+        self.property = property
+        self.decode = decode
+        self.unit = unit
+        self.batch = TemperatureBatch(size)
+        self.reported = False
+        return
+
+
+class AcState():
+    __slots__ = ("ac", "account", "unitClass")
+
+    def __init__(self, ac, account, unitClass):
+        self.ac = ac
+        self.account = account
+        self.unitClass = unitClass
+        return
+
+
+class UnitState():
+    __slots__ = ("dsn", "ac", "command", "currentValue", "convert", "commandValues",
+                 "dependantUnit", "dependantIfValue", "dependantSetValue", "lastValue")
+
+    def __init__(self, dsn, ac, command, currentValue, converter):
+        self.dsn = dsn
+        self.ac = ac
+        self.command = command
+        self.currentValue = currentValue
+        self.convert = converter.convert
+        self.commandValues = getattr(converter, "commandValues", None)
+        self.dependantUnit = None
+        self.dependantIfValue = None
+        self.dependantSetValue = None
+        self.lastValue = None
+        return
+
+    def setDependantSwitch(self, unit, ifValue, setValue):
+        self.dependantUnit = unit
+        self.dependantIfValue = ifValue
+        self.dependantSetValue = setValue
+        return
+
+
+# One FGLair session per account, the API object is kept to reuse its token.
+# pyfujitseu reads and rewrites the token file on every call, so the calls of
+# an account are serialized by its lock, only different accounts run in parallel
+class Account():
+    def __init__(self, username, password, region, tokenFolder):
         self.username = username
         self.password = password
         self.region = region
+        self.tokenPath = os.path.join(tokenFolder, "token_%s.txt" % (hashlib.sha1(username.encode("utf-8")).hexdigest()[:12]))
+        self.api = None
+        self.dsns = []
+        self.lock = threading.Lock()
+        return
+
+    def _getApi(self):
+        if self.api is None:
+            self.api = splitAC.api(self.username, self.password, self.region, self.tokenPath)
+        return self.api
+
+    def call(self, function, *args):
+        with self.lock:
+            return function(*args)
+
+    def getDevicesDsn(self):
+        with self.lock:
+            self.dsns = self._getApi().get_devices_dsn()
+            return self.dsns
+
+    # Returns the created devices and the errors by DSN
+    def createSplitACs(self, dsns):
+        acs = {}
+        errors = {}
+        with self.lock:
+            for dsn in dsns:
+                try:
+                    acs[dsn] = splitAC.splitAC(dsn, self._getApi())
+                except Exception as inst:
+                    errors[dsn] = inst
+        return acs, errors
+
+    # Refreshes the devices of the account one after the other and lists its
+    # devices, returns the DSNs(None if the listing failed), the listing error
+    # and the refresh errors by DSN
+    def refresh(self, acs):
+        dsns = None
+        listError = None
+        errors = {}
+        with self.lock:
+            for dsn, ac in acs:
+                try:
+                    ac.refresh_properties()
+                except Exception as inst:
+                    errors[dsn] = inst
+            try:
+                self.dsns = self._getApi().get_devices_dsn()
+                dsns = self.dsns
+            except Exception as inst:
+                listError = inst
+        return dsns, listError, errors
+
+
+class Helper():
+    def __init__(self, accounts, interval, store, debug, outdoorTemperatureTable=None):
+        self.accounts = accounts
+        self.debug = debug
+        self.store = store
+        self.pool = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE)
         self.acs = {}
         self.usedUnitClasses = []
+        self.usedSensorUnits = []
         self.databaseStore = {}
         self.units = {}
-        self.selectorData = {}
+        self.sensors = {}
+        self.temperatureSamples = max(1, TEMPERATURE_REPORT_INTERVAL // interval)
+        self.outdoorTemperatureTable = outdoorTemperatureTable
+        # The outdoor sensors only get units if they can be decoded
+        self.sensorUnitKeys = ["sensorUnit"]
+        if outdoorTemperatureTable is not None:
+            self.sensorUnitKeys.append("outdoorSensorUnit")
+        return
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
         return
     
+    def _isUnitUsed(self, unit):
+        if unit in self.usedSensorUnits:
+            return True
+        for unitClass in self.usedUnitClasses:
+            if unitClass < unit <= unitClass + UNIT_CLASS_SIZE:
+                return True
+        return False
+
     def _getNextUnitClass(self):
         unitClass = 0
-        while unitClass in self.usedUnitClasses:
-            unitClass += 11
+        while unitClass in self.usedUnitClasses or any(unitClass < unit <= unitClass + UNIT_CLASS_SIZE for unit in self.usedSensorUnits):
+            unitClass += UNIT_CLASS_SIZE
+        if unitClass + UNIT_CLASS_SIZE > MAX_UNIT:
+            return None
         return unitClass
 
-    def _addAcToList(self, dsn, api, unitClass):
-        ac = splitAC.splitAC(dsn, api)
-        Domoticz.Debug("  - %s - %s" % (dsn, ac.device_name["value"]))
-        self.usedUnitClasses.append(unitClass)
-        self.acs[dsn] = {
-            "ac": ac,
-            "unitClass": unitClass
-        }
-        self.databaseStore[dsn] = unitClass
+    # The temperature sensors are allocated from the end of the unit range,
+    # units occupied by other devices(e.g. left from removed devices) are skipped
+    def _getNextSensorUnit(self):
+        unit = MAX_UNIT
+        while unit > 0 and (self._isUnitUsed(unit) or unit in Devices):
+            unit -= 1
+        if unit <= 0:
+            return None
+        return unit
+
+    def _allocateSensorUnits(self, dsn):
+        entry = self.databaseStore[dsn]
+        for key in self.sensorUnitKeys:
+            if key in entry:
+                continue
+            sensorUnit = self._getNextSensorUnit()
+            if sensorUnit is None:
+                Domoticz.Error("No free Domoticz unit left for the temperature sensors of %s" % (dsn))
+                return
+            entry[key] = sensorUnit
+            self.usedSensorUnits.append(sensorUnit)
+        return
+
+    def _getAccount(self, username):
+        for account in self.accounts:
+            if account.username == username:
+                return account
+        return None
+
+    # Network calls of every account run on the shared worker pool,
+    # Domoticz is only called from the plugin thread
+    def _fetchDsns(self, accounts):
+        futures = [(account, self.pool.submit(account.getDevicesDsn)) for account in accounts]
+        result = {}
+        for account, future in futures:
+            try:
+                result[account.username] = future.result()
+            except Exception as inst:
+                Domoticz.Error("Getting devices failed for %s: '%s'" % (account.username, str(inst)))
+        return result
+
+    # One task per account, the devices of an account are created in order
+    def _addAcsToList(self, newAcs):
+        futures = []
+        for account in self.accounts:
+            dsns = [dsn for dsn, owner, unitClass in newAcs if owner is account]
+            if len(dsns) > 0:
+                futures.append(self.pool.submit(account.createSplitACs, dsns))
+        acs = {}
+        for future in futures:
+            created, errors = future.result()
+            acs.update(created)
+            for dsn in errors:
+                Domoticz.Error("Initializing device %s failed: '%s'" % (dsn, str(errors[dsn])))
+
+        added = []
+        for dsn, account, unitClass in newAcs:
+            if dsn not in acs:
+                continue
+            Domoticz.Debug("  - %s - %s (%s)" % (dsn, acs[dsn].device_name["value"], account.username))
+            self.acs[dsn] = AcState(acs[dsn], account, unitClass)
+            added.append(dsn)
+        return added
+
+    def _allocateNewAcs(self, dsnsByAccount):
+        newAcs = []
+        newDsns = []
+        for account in self.accounts:
+            for dsn in dsnsByAccount.get(account.username, []):
+                # A device shared by several accounts is handled by the first one
+                if dsn in self.acs or dsn in newDsns:
+                    continue
+                newDsns.append(dsn)
+                if dsn in self.databaseStore:
+                    unitClass = self.databaseStore[dsn]["unitClass"]
+                else:
+                    unitClass = self._getNextUnitClass()
+                    if unitClass is None:
+                        Domoticz.Error("No free Domoticz unit left for device %s of %s" % (dsn, account.username))
+                        continue
+                    self.usedUnitClasses.append(unitClass)
+                    self.databaseStore[dsn] = {
+                        "account": account.username,
+                        "unitClass": unitClass
+                    }
+                    self._allocateSensorUnits(dsn)
+                self.databaseStore[dsn]["account"] = account.username
+                newAcs.append((dsn, account, unitClass))
+        return newAcs
+    
+    def _saveDatabaseStore(self):
+        for dsn in list(self.store.getSection(DATABASE_KEY)):
+            if dsn not in self.databaseStore:
+                self.store.removeItem(DATABASE_KEY, dsn)
+        for dsn in self.databaseStore:
+            self.store.setItem(DATABASE_KEY, dsn, self.databaseStore[dsn])
+        return
     
     def getAcs(self):
-        api = splitAC.api(self.username, self.password, self.region)
-        dsns = api.get_devices_dsn()
-        Domoticz.Log("Connected to FGLair API and found %d device(s) for %s" % (len(dsns), self.username))
+        dsnsByAccount = self._fetchDsns(self.accounts)
+        for username in dsnsByAccount:
+            Domoticz.Log("Connected to FGLair API and found %d device(s) for %s" % (len(dsnsByAccount[username]), username))
 
         Domoticz.Log("Checking database for saved devices ...")
-        storedData = getConfigItem()
+        storedData = self.store.getSection(DATABASE_KEY)
         Domoticz.Log("Found %d devices in the database, removing old ones ..." % (len(storedData)))
-        existingDsns = []
+        existingAcs = []
         for dsn in storedData:
-            if dsn in dsns:
-                existingDsns.append(dsn)
-        Domoticz.Log("Found %d existing devices in the list" % (len(existingDsns)))
+            entry = storedData[dsn]
+            # Migrating the single account format: {dsn: unitClass}
+            if not isinstance(entry, dict):
+                entry = {"account": None, "unitClass": entry}
+            owner = None
+            for username in dsnsByAccount:
+                if dsn in dsnsByAccount[username]:
+                    owner = username
+                    break
+            if owner is not None:
+                entry = dict(entry)
+                entry["account"] = owner
+                existingAcs.append((dsn, self._getAccount(owner), entry["unitClass"]))
+            elif entry["account"] is None and len(dsnsByAccount) == len(self.accounts):
+                continue
+            elif entry["account"] is not None and (self._getAccount(entry["account"]) is None or entry["account"] in dsnsByAccount):
+                continue
+            # Keeping the units of unreachable accounts reserved
+            self.usedUnitClasses.append(entry["unitClass"])
+            for key in ["sensorUnit", "outdoorSensorUnit"]:
+                if key in entry:
+                    self.usedSensorUnits.append(entry[key])
+            self.databaseStore[dsn] = entry
+        for dsn in self.databaseStore:
+            self._allocateSensorUnits(dsn)
+        Domoticz.Log("Found %d existing devices in the list" % (len(existingAcs)))
 
         Domoticz.Debug("The existing device(s):")
-        for dsn in existingDsns:
-            self._addAcToList(dsn, api, storedData[dsn])
+        self._addAcsToList(existingAcs)
         
         Domoticz.Debug("The new device(s):")
-        for dsn in dsns:
-            if dsn not in existingDsns:
-                self._addAcToList(dsn, api, self._getNextUnitClass())
+        self._addAcsToList(self._allocateNewAcs(dsnsByAccount))
         
-        setConfigItem(self.databaseStore)
+        self._saveDatabaseStore()
         
         return
     
     def updateAcs(self):
-        api = splitAC.api(self.username, self.password, self.region)
-        dsns = api.get_devices_dsn()
-        foundNewDevice = False
-        for dsn in dsns:
-            if dsn not in self.acs:
-                foundNewDevice = True
-                Domoticz.Log("Found a new device(%s) while was updating the properties" % (dsn))
-                self._addAcToList(dsn, api, self._getNextUnitClass())
-                self.createDomoticzDevices(dsn)
-        
-        if foundNewDevice:
-            setConfigItem(self.databaseStore)
+        # One task per account, so the accounts are refreshed in parallel
+        futures = []
+        for account in self.accounts:
+            acs = [(dsn, self.acs[dsn].ac) for dsn in self.acs if self.acs[dsn].account is account]
+            futures.append((account, self.pool.submit(account.refresh, acs)))
 
-        for dsn in self.acs:
-            self.acs[dsn]["ac"].refresh_properties()
-            Domoticz.Debug("Refreshing properties: %s - %s" % (dsn, self.acs[dsn]["ac"].device_name["value"]))
+        dsnsByAccount = {}
+        for account, future in futures:
+            dsns, listError, errors = future.result()
+            if listError is not None:
+                Domoticz.Error("Getting devices failed for %s: '%s'" % (account.username, str(listError)))
+            else:
+                dsnsByAccount[account.username] = dsns
+            for dsn in self.acs:
+                if self.acs[dsn].account is not account:
+                    continue
+                if dsn in errors:
+                    Domoticz.Error("Refreshing properties failed for %s: '%s'" % (dsn, str(errors[dsn])))
+                else:
+                    Domoticz.Debug("Refreshing properties: %s - %s" % (dsn, self.acs[dsn].ac.device_name["value"]))
+
+        newAcs = self._allocateNewAcs(dsnsByAccount)
+        for dsn, account, unitClass in newAcs:
+            Domoticz.Log("Found a new device(%s) for %s while was updating the properties" % (dsn, account.username))
+        for dsn in self._addAcsToList(newAcs):
+            self.createDomoticzDevices(dsn)
+        
+        if len(newAcs) > 0:
+            self._saveDatabaseStore()
         return
     
     def createDomoticzDevices(self, dsn):
-        name = self.acs[dsn]["ac"].device_name["value"]
-        unitClass = self.acs[dsn]["unitClass"]
-        verticalDirection = self.acs[dsn]["ac"].af_vertical_direction
+        ac = self.acs[dsn].ac
+        name = ac.device_name["value"]
+        unitClass = self.acs[dsn].unitClass
+        verticalDirection = ac.af_vertical_direction
 
         Domoticz.Log("Creating devices in Domoticz for %s - %s" % (dsn, name))
 
@@ -191,18 +926,8 @@ class Helper():
             Domoticz.Device(Name="%s - Power"%(name), Unit=unit, Image=16, TypeName="Switch").Create()
         else:
             Domoticz.Debug("%s - Power switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "switch",
-            "dsn": dsn,
-            "command": self.powerSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.powerSwitchCurrentValue,
-            "dependantSwitch": {
-                "unit": unitClass + 3,
-                "ifValue": "off",
-                "setValue": 10
-            }
-        }
+        self.units[unit] = UnitState(dsn, ac, self.powerSwitch, self.powerSwitchCurrentValue, SWITCH)
+        self.units[unit].setDependantSwitch(unitClass + 3, "off", 10)
 
         unit = unitClass + 2
         if unit not in Devices:
@@ -214,29 +939,7 @@ class Helper():
             Domoticz.Device(Name="%s - Temperature selector"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
         else:
             Domoticz.Debug("%s - Temperature selector switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "selector",
-            "dsn": dsn,
-            "command": self.temperatureSelectorSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.temperatureSelectorSwitchCurrentValue
-        }
-        self.selectorData[unit] = {
-            "18.0": 10,  "18.5": 20,  "19.0": 30,  "19.5": 40,
-            "20.0": 50,  "20.5": 60,  "21.0": 70,  "21.5": 80,
-            "22.0": 90,  "22.5": 100, "23.0": 110, "23.5": 120,
-            "24.0": 130, "24.5": 140, "25.0": 150, "25.5": 160,
-            "26.0": 170, "26.5": 180, "27.0": 190, "27.5": 200,
-            "28.0": 210, "28.5": 220, "29.0": 230, "29.5": 240,
-            "30.0": 250, "30.5": 260, "31.0": 270, "31.5": 280, "32": 290,
-            "10": 18,  "20": 18.5,  "30": 19,  "40": 19.5,
-            "50": 20,  "60": 20.5,  "70": 21,  "80": 21.5,
-            "90": 22,  "100": 22.5, "110": 23, "120": 23.5,
-            "130": 24, "140": 24.5, "150": 25, "160": 25.5,
-            "170": 26, "180": 26.5, "190": 27, "200": 27.5,
-            "210": 28, "220": 28.5, "230": 29, "240": 29.5,
-            "250": 30, "260": 30.5, "270": 31, "280": 31.5, "290": 32
-        }
+        self.units[unit] = UnitState(dsn, ac, self.temperatureSelectorSwitch, self.temperatureSelectorSwitchCurrentValue, TEMPERATURE_SELECTOR)
 
         unit = unitClass + 3
         if unit not in Devices:
@@ -248,19 +951,7 @@ class Helper():
             Domoticz.Device(Name="%s - Operation selector"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
         else:
             Domoticz.Debug("%s - Operation selector switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "selector",
-            "dsn": dsn,
-            "command": self.operationSelectorSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.operationSelectorSwitchCurrentValue
-        }
-        self.selectorData[unit] = {
-            "off": 10,   "auto": 20,       "cool": 30,
-            "dry": 40,   "fan only": 50,   "heat": 60,
-            "10": "Off", "20": "Auto",     "30": "Cool",
-            "40": "Dry", "50": "Fan only", "60": "Heat"
-        }
+        self.units[unit] = UnitState(dsn, ac, self.operationSelectorSwitch, self.operationSelectorSwitchCurrentValue, OPERATION_SELECTOR)
 
         unit = unitClass + 4
         if unit not in Devices:
@@ -268,13 +959,7 @@ class Helper():
             Domoticz.Device(Name="%s - Economy"%(name), Unit=unit, Image=16, TypeName="Switch").Create()
         else:
             Domoticz.Debug("%s - Economy switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "switch",
-            "dsn": dsn,
-            "command": self.economySwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.economySwitchCurrentValue
-        }
+        self.units[unit] = UnitState(dsn, ac, self.economySwitch, self.economySwitchCurrentValue, SWITCH)
 
         unit = unitClass + 5
         if unit not in Devices:
@@ -282,13 +967,7 @@ class Helper():
             Domoticz.Device(Name="%s - Powerfull mode"%(name), Unit=unit, Image=16, TypeName="Switch").Create()
         else:
             Domoticz.Debug("%s - Powerfull mode switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "switch",
-            "dsn": dsn,
-            "command": self.powerfullModeSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.powerfullModeSwitchCurrentValue
-        }
+        self.units[unit] = UnitState(dsn, ac, self.powerfullModeSwitch, self.powerfullModeSwitchCurrentValue, SWITCH)
 
         unit = unitClass + 6
         if unit not in Devices:
@@ -300,19 +979,7 @@ class Helper():
             Domoticz.Device(Name="%s - Fan speed"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
         else:
             Domoticz.Debug("%s - Fan speed switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "selector",
-            "dsn": dsn,
-            "command": self.fanSpeedSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.fanSpeedSwitchCurrentValue
-        }
-        self.selectorData[unit] = {
-            "quiet": 10,   "low": 20,   "medium": 30,
-            "high": 40,    "auto": 50,
-            "10": "Quiet", "20": "Low", "30": "Medium",
-            "40": "High",  "50": "Auto"
-        }
+        self.units[unit] = UnitState(dsn, ac, self.fanSpeedSwitch, self.fanSpeedSwitchCurrentValue, FAN_SPEED_SELECTOR)
 
         unit = unitClass + 7
         if unit not in Devices:
@@ -320,13 +987,7 @@ class Helper():
             Domoticz.Device(Name="%s - Vertical swing"%(name), Unit=unit, Image=16, TypeName="Switch").Create()
         else:
             Domoticz.Debug("%s - Vertical swing switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "switch",
-            "dsn": dsn,
-            "command": self.verticalSwingSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.verticalSwingSwitchCurrentValue
-        }
+        self.units[unit] = UnitState(dsn, ac, self.verticalSwingSwitch, self.verticalSwingSwitchCurrentValue, SWITCH)
 
         unit = unitClass + 8
         if unit not in Devices:
@@ -334,13 +995,7 @@ class Helper():
             Domoticz.Device(Name="%s - Horizontal swing"%(name), Unit=unit, Image=16, TypeName="Switch").Create()
         else:
             Domoticz.Debug("%s - Horizontal swing switch already exists with unit ID: %d" % (dsn, unit))
-        self.units[unit] = {
-            "type": "switch",
-            "dsn": dsn,
-            "command": self.horizontalSwingSwitch,
-            "update": self.updateDomoticzDevice,
-            "currentValue": self.horizontalSwingSwitchCurrentValue
-        }
+        self.units[unit] = UnitState(dsn, ac, self.horizontalSwingSwitch, self.horizontalSwingSwitchCurrentValue, SWITCH)
 
         if verticalDirection != None:
             unit = unitClass + 9
@@ -353,19 +1008,7 @@ class Helper():
                 Domoticz.Device(Name="%s - Swing mode"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
             else:
                 Domoticz.Debug("%s - Swing mode switch already exists with unit ID: %d" % (dsn, unit))
-            self.units[unit] = {
-                "type": "selector",
-                "dsn": dsn,
-                "command": self.swingModeSwitch,
-                "update": self.updateDomoticzDevice,
-                "currentValue": self.swingModeSwitchCurrentValue
-            }
-            self.selectorData[unit] = {
-                "Horizontal": 10,   "Down": 20,
-                "Unknown": 30,      "Swing": 40,
-                "10": "Horizontal", "20": "Down",
-                "30": "Unknown",    "40": "Swing"
-            }
+            self.units[unit] = UnitState(dsn, ac, self.swingModeSwitch, self.swingModeSwitchCurrentValue, SWING_MODE_SELECTOR)
 
             unit = unitClass + 10
             if unit not in Devices:
@@ -377,19 +1020,7 @@ class Helper():
                 Domoticz.Device(Name="%s - Vertical direction"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
             else:
                 Domoticz.Debug("%s - Vertical direction switch already exists with unit ID: %d" % (dsn, unit))
-            self.units[unit] = {
-                "type": "selector",
-                "dsn": dsn,
-                "command": self.verticalDirectionSwitch,
-                "update": self.updateDomoticzDevice,
-                "currentValue": self.verticalDirectionSwitchCurrentValue
-            }
-            self.selectorData[unit] = {
-                "1": 10, "2": 20, "3": 30, "4": 40,
-                "5": 50, "6": 60, "7": 70,
-                "10": 1, "20": 2, "30": 3, "40": 4,
-                "50": 5, "60": 6, "70": 7
-            }
+            self.units[unit] = UnitState(dsn, ac, self.verticalDirectionSwitch, self.verticalDirectionSwitchCurrentValue, DIRECTION_SELECTOR)
             
             unit = unitClass + 11
             if unit not in Devices:
@@ -401,19 +1032,30 @@ class Helper():
                 Domoticz.Device(Name="%s - Horizontal direction"%(name), Unit=unit, Image=16, TypeName="Selector Switch", Options=Options).Create()
             else:
                 Domoticz.Debug("%s - Horizontal direction switch already exists with unit ID: %d" % (dsn, unit))
-            self.units[unit] = {
-                "type": "selector",
-                "dsn": dsn,
-                "command": self.horizontalDirectionSwitch,
-                "update": self.updateDomoticzDevice,
-                "currentValue": self.horizontalDirectionSwitchCurrentValue
-            }
-            self.selectorData[unit] = {
-                "1": 10, "2": 20, "3": 30, "4": 40,
-                "5": 50, "6": 60, "7": 70,
-                "10": 1, "20": 2, "30": 3, "40": 4,
-                "50": 5, "60": 6, "70": 7
-            }
+            self.units[unit] = UnitState(dsn, ac, self.horizontalDirectionSwitch, self.horizontalDirectionSwitchCurrentValue, DIRECTION_SELECTOR)
+
+        self.createTemperatureSensor(dsn, "sensorUnit", "display_temperature", "Indoor", getTemperature)
+        if self.outdoorTemperatureTable is not None:
+            self.createTemperatureSensor(dsn, "outdoorSensorUnit", "outdoor_temperature", "Outdoor", self.outdoorTemperatureTable.decode)
+        return
+
+    # The sensor is only created if the unit reports the property
+    def createTemperatureSensor(self, dsn, unitKey, property, label, decode):
+        ac = self.acs[dsn].ac
+        name = ac.device_name["value"]
+        unit = self.databaseStore[dsn].get(unitKey)
+        if unit is None or getattr(ac, property, None) == None:
+            return
+
+        if unit not in Devices:
+            Domoticz.Debug("%s - Creating %s temperature sensor" % (dsn, label.lower()))
+            Domoticz.Device(Name="%s - %s temperature"%(name, label), Unit=unit, TypeName="Temperature").Create()
+        elif Devices[unit].Type != TEMPERATURE_DEVICE_TYPE:
+            Domoticz.Error("%s - Unit %d is used by another device(%s), skipping the %s temperature sensor" % (dsn, unit, Devices[unit].Name, label.lower()))
+            return
+        else:
+            Domoticz.Debug("%s - %s temperature sensor already exists with unit ID: %d" % (dsn, label, unit))
+        self.sensors[unit] = TemperatureSensor(dsn, ac, property, decode, unit, self.temperatureSamples)
         return
 
     def initializeDomoticz(self):
@@ -423,18 +1065,18 @@ class Helper():
         return
 
     def runCommand(self, unit, command, level):
-        dsn = self.units[unit]["dsn"]
-        updateValues = self.units[unit]["command"](unit, dsn, command, str(level))
-        self.units[unit]["update"](unit, updateValues["nValue"], updateValues["sValue"])
-        if "dependantSwitch" in self.units[unit] and self.units[unit]["dependantSwitch"]["ifValue"] == updateValues["sValue"].lower():
-            self.updateDomoticzDevice(self.units[unit]["dependantSwitch"]["unit"], updateValues["nValue"], self.units[unit]["dependantSwitch"]["setValue"])
+        state = self.units[unit]
+        updateValues = self.acs[state.dsn].account.call(state.command, unit, state.dsn, command, str(level))
+        self.updateDomoticzDevice(unit, updateValues["nValue"], updateValues["sValue"])
+        if state.dependantUnit is not None and state.dependantIfValue == updateValues["sValue"].lower():
+            self.updateDomoticzDevice(state.dependantUnit, updateValues["nValue"], state.dependantSetValue)
         return
     
-    def powerSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].operation_mode_desc
+    def powerSwitchCurrentValue(self, ac):
+        return ac.operation_mode_desc
 
     def powerSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         nValue = 0
         sValue = "Off"
         if command.lower() == "on":
@@ -448,30 +1090,30 @@ class Helper():
             "sValue": sValue
         }
     
-    def temperatureSelectorSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].adjust_temperature_degree
+    def temperatureSelectorSwitchCurrentValue(self, ac):
+        return ac.adjust_temperature_degree
 
     def temperatureSelectorSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         ac.changeTemperature(float(sValue))
         return {
             "nValue": nValue,
             "sValue": level
         }
     
-    def operationSelectorSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].operation_mode_desc
+    def operationSelectorSwitchCurrentValue(self, ac):
+        return ac.operation_mode_desc
     
     def operationSelectorSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         if sValue == "Fan only":
             sValue = "fan_only"
         ac.changeOperationMode(sValue)
@@ -480,11 +1122,11 @@ class Helper():
             "sValue": level
         }
     
-    def economySwitchCurrentValue(self, dsn):
-        return "On" if self.acs[dsn]["ac"].economy_mode["value"] else "Off"
+    def economySwitchCurrentValue(self, ac):
+        return "On" if ac.economy_mode["value"] else "Off"
     
     def economySwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         nValue = 0
         sValue = "Off"
         if command.lower() == "on":
@@ -498,11 +1140,11 @@ class Helper():
             "sValue": sValue
         }
     
-    def powerfullModeSwitchCurrentValue(self, dsn):
-        return "On" if self.acs[dsn]["ac"].powerful_mode["value"] else "Off"
+    def powerfullModeSwitchCurrentValue(self, ac):
+        return "On" if ac.powerful_mode["value"] else "Off"
     
     def powerfullModeSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         nValue = 0
         sValue = "Off"
         if command.lower() == "on":
@@ -516,26 +1158,26 @@ class Helper():
             "sValue": sValue
         }
     
-    def fanSpeedSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].get_fan_speed_desc()
+    def fanSpeedSwitchCurrentValue(self, ac):
+        return ac.get_fan_speed_desc()
     
     def fanSpeedSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         ac.changeFanSpeed(sValue)
         return {
             "nValue": nValue,
             "sValue": level
         }
     
-    def verticalSwingSwitchCurrentValue(self, dsn):
-        return "On" if self.acs[dsn]["ac"].af_vertical_swing["value"] else "Off"
+    def verticalSwingSwitchCurrentValue(self, ac):
+        return "On" if ac.af_vertical_swing["value"] else "Off"
     
     def verticalSwingSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         nValue = 0
         sValue = "Off"
         if command.lower() == "on":
@@ -549,11 +1191,11 @@ class Helper():
             "sValue": sValue
         }
     
-    def horizontalSwingSwitchCurrentValue(self, dsn):
-        return "On" if self.acs[dsn]["ac"].af_horizontal_swing["value"] else "Off"
+    def horizontalSwingSwitchCurrentValue(self, ac):
+        return "On" if ac.af_horizontal_swing["value"] else "Off"
     
     def horizontalSwingSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         nValue = 0
         sValue = "Off"
         if command.lower() == "on":
@@ -567,45 +1209,45 @@ class Helper():
             "sValue": sValue
         }
     
-    def swingModeSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].get_swing_mode_desc
+    def swingModeSwitchCurrentValue(self, ac):
+        return ac.get_swing_mode_desc()
     
     def swingModeSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         ac.changeSwingMode(sValue)
         return {
             "nValue": nValue,
             "sValue": level
         }
 
-    def verticalDirectionSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].af_vertical_direction["value"]
+    def verticalDirectionSwitchCurrentValue(self, ac):
+        return ac.af_vertical_direction["value"]
     
     def verticalDirectionSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         ac.vertical_direction(int(sValue))
         return {
             "nValue": nValue,
             "sValue": level
         }
     
-    def horizontalDirectionSwitchCurrentValue(self, dsn):
-        return self.acs[dsn]["ac"].af_horizontal_direction["value"]
+    def horizontalDirectionSwitchCurrentValue(self, ac):
+        return ac.af_horizontal_direction["value"]
     
     def horizontalDirectionSwitch(self, unit, dsn, command, level):
-        ac = self.acs[dsn]["ac"]
+        ac = self.acs[dsn].ac
         ac.refresh_properties()
         om = ac.operation_mode_desc
         nValue = 0 if om.lower() == "off" else 1
-        sValue = self.selectorData[unit][level]
+        sValue = self.units[unit].commandValues[level]
         ac.horizontal_direction(int(sValue))
         return {
             "nValue": nValue,
@@ -613,27 +1255,42 @@ class Helper():
         }
     
     def updateDomoticzDevice(self, unit, nValue, sValue):
-        Domoticz.Debug("Updating Domoticz device %s/%d: (%d,%s)" % (self.units[unit]["dsn"], unit, nValue, sValue))
-        Devices[unit].Update(nValue = nValue, sValue = str(sValue))
+        sValue = str(sValue)
+        if self.debug:
+            Domoticz.Debug("Updating Domoticz device %s/%d: (%d,%s)" % (self.units[unit].dsn, unit, nValue, sValue))
+        self.units[unit].lastValue = (nValue, sValue)
+        Devices[unit].Update(nValue = nValue, sValue = sValue)
     
+    # Only the changed units are written into Domoticz
     def updateDomoticzDevices(self):
-        for unit in self.units:
-            dsn = self.units[unit]["dsn"]
-            unitType = self.units[unit]["type"]
-            value = self.units[unit]["currentValue"](dsn)
-            om = self.acs[dsn]["ac"].operation_mode_desc
-            
-            nValue = 0 if om.lower() == "off" else 1
-            sValue = value
-            if unitType == "switch":
-                nValue = 0 if value.lower() == "off" else 1
-                sValue = "On" if sValue else "Off"
-            if isinstance(sValue, str) and "fan" in sValue.lower():
-            	sValue = "Fan only"
-            if unit in self.selectorData and (str(sValue)).lower() in self.selectorData[unit]:
-                sValue = self.selectorData[unit][(str(sValue)).lower()]
+        isOn = {}
+        for dsn in self.acs:
+            isOn[dsn] = self.acs[dsn].ac.operation_mode_desc.lower() != "off"
+
+        for unit, state in self.units.items():
+            value = state.convert(state.currentValue(state.ac), isOn[state.dsn])
+            if value != state.lastValue:
+                self.updateDomoticzDevice(unit, value[0], value[1])
 
-            self.updateDomoticzDevice(unit, nValue, sValue)
+        self.updateTemperatureSensors()
+        return
+
+    # Every refresh is sampled, but only the averages are written into Domoticz,
+    # the first sample is written immediately to have a value after startup
+    def updateTemperatureSensors(self):
+        for sensor in self.sensors.values():
+            temperature = sensor.decode(getattr(sensor.ac, sensor.property, None))
+            sensor.batch.add(temperature)
+            if sensor.reported and not sensor.batch.isFull():
+                continue
+            if sensor.reported:
+                temperature = sensor.batch.average()
+            sensor.reported = True
+            if temperature is None or temperature != temperature:
+                continue
+            if self.debug:
+                Domoticz.Debug("Updating Domoticz temperature sensor %s/%d: %s" % (sensor.dsn, sensor.unit, str(temperature)))
+            Devices[sensor.unit].Update(nValue = 0, sValue = str(temperature))
         return
 
 
@@ -643,6 +1300,8 @@ class FujitsuACPlugin:
         self.lastState = None
         self.heartbeat = None
         self.helper = None
+        self.store = None
+        self.trafficTokenFolder = None
         return
 
     def onStart(self):
@@ -657,9 +1316,23 @@ class FujitsuACPlugin:
         self.heartbeat = Heartbeat(int(Parameters["Mode3"]))
         self.heartbeat.setHeartbeat(self.update)
 
+        # Setting up API traffic capture or replay, these sessions log in
+        # with throwaway token files to keep the real tokens untouched
+        tokenFolder = Parameters["HomeFolder"]
+        if setupTraffic(Parameters["Mode6"], Parameters["HomeFolder"]):
+            self.trafficTokenFolder = tempfile.mkdtemp(prefix="fglair_")
+            tokenFolder = self.trafficTokenFolder
+
+        # Loading the stored configuration
+        self.store = ConfigStore(CONFIG_FLUSH_INTERVAL)
+        self.store.load()
+
         # Setting up helper
-        Domoticz.Log("Mode1: %s, Password: %s, Mode2: %s" % (Parameters["Mode1"], Parameters["Password"], Parameters["Mode2"]))
-        self.helper = Helper(Parameters["Mode1"], Parameters["Password"], Parameters["Mode2"])
+        accounts = getAccounts(Parameters["Mode1"], Parameters["Password"], Parameters["Mode2"], Parameters["Mode5"], tokenFolder)
+        for account in accounts:
+            Domoticz.Log("Account: %s, Region: %s" % (account.username, account.region))
+        outdoorTemperatureTable = loadOutdoorTemperatureTable(Parameters["HomeFolder"])
+        self.helper = Helper(accounts, int(Parameters["Mode3"]), self.store, Parameters["Mode4"] != "off", outdoorTemperatureTable)
 
         # Getting air conditioners
         self.helper.getAcs()
@@ -670,12 +1343,21 @@ class FujitsuACPlugin:
         #Updating Domoticz devices
         self.update()
 
+        # Saving the device allocation
+        self.store.flush()
+
         DumpConfigToLog()
 
         return
 
     def onStop(self):
         Domoticz.Log("onStop called")
+        if self.helper is not None:
+            self.helper.shutdown()
+        if self.store is not None:
+            self.store.flush(force=True)
+        if self.trafficTokenFolder is not None:
+            shutil.rmtree(self.trafficTokenFolder, ignore_errors=True)
         return
 
     def onConnect(self, Connection, Status, Description):
@@ -702,6 +1384,7 @@ class FujitsuACPlugin:
     def onHeartbeat(self):
         Domoticz.Debug("onHeartbeat called")
         self.heartbeat.beatHeartbeat()
+        self.store.flush()
         return
 
     def update(self):
@@ -748,7 +1431,7 @@ def onHeartbeat():
 
 def DumpConfigToLog():
     for x in Parameters:
-        if Parameters[x] != "":
+        if Parameters[x] != "" and x not in ["Password", "Mode5"]:
             Domoticz.Debug( "'" + x + "':'" + str(Parameters[x]) + "'")
     Domoticz.Debug("Device count: " + str(len(Devices)))
     for x in Devices: